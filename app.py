@@ -1,25 +1,123 @@
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, g
 import bcrypt
+import hashlib
+import orjson
 import sqlite3
 import os
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError: # argon2-cffi 为可选依赖
+    PasswordHasher = None
 
 # 配置日志
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper()) # 生产环境默认 INFO，调试时设置 LOG_LEVEL=DEBUG
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# 函数：使用 orjson 序列化 JSON 响应 (替代 jsonify)
+def _json(obj, status=200):
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
 # --- 数据库配置 ---
 DATABASE = os.path.join('/tmp', 'users.db') # Render等平台通常/tmp可写
-logger.info(f"Database path: {DATABASE}")
+logger.info("Database path: %s", DATABASE)
+
+# --- 密码哈希配置 ---
+# bcrypt>=4.0 使用 Rust 实现的 Eksblowfish；未设置 BCRYPT_COST 时在启动时按硬件自动校准
+BCRYPT_COST = int(os.environ['BCRYPT_COST']) if os.environ.get('BCRYPT_COST') else None
+BCRYPT_MIN_COST, BCRYPT_MAX_COST = 12, 14 # 下限 12 (bcrypt 默认值)，校准只会提高 cost，不会在慢机器上削弱哈希
+BCRYPT_TARGET_MS = float(os.environ.get('BCRYPT_TARGET_MS', 250)) # 单次哈希的目标耗时上限
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'bcrypt').lower() # 新用户使用的算法: bcrypt / argon2
+BCRYPT_MAX_PASSWORD_BYTES = 72 # bcrypt 只处理前 72 字节，bcrypt>=5.0 对更长的密码直接抛出 ValueError
+
+if PASSWORD_HASHER == 'argon2' and PasswordHasher is None:
+    logger.warning("PASSWORD_HASHER=argon2 but argon2-cffi is not installed, falling back to bcrypt")
+    PASSWORD_HASHER = 'bcrypt'
+_argon2_hasher = PasswordHasher() if PasswordHasher is not None else None
+
+# 函数：选出耗时不超过 BCRYPT_TARGET_MS 的最大 cost (至少为 BCRYPT_MIN_COST)
+# 只计时一次 BCRYPT_MIN_COST，cost 每加 1 耗时翻倍，据此推算更高的 cost
+def calibrate_bcrypt_cost():
+    start = time.perf_counter()
+    bcrypt.hashpw(b'x', bcrypt.gensalt(rounds=BCRYPT_MIN_COST))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.debug("bcrypt cost %s: %.1f ms", BCRYPT_MIN_COST, elapsed_ms)
+    cost = BCRYPT_MIN_COST
+    while cost < BCRYPT_MAX_COST and elapsed_ms * 2 <= BCRYPT_TARGET_MS:
+        elapsed_ms *= 2
+        cost += 1
+    return cost
+
+# 函数：为新用户生成密码哈希 (返回 bytes，直接存入 BLOB 列)
+def hash_password(password, rounds):
+    if PASSWORD_HASHER == 'argon2':
+        return _argon2_hasher.hash(password).encode('ascii')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds))
+
+# 函数：校验密码 (按哈希前缀区分 argon2 与 bcrypt，兼容已有用户)
+def check_password(password, stored_hash):
+    if isinstance(stored_hash, str): # 旧版本以 TEXT 存储的哈希
+        stored_hash = stored_hash.encode('utf-8')
+    if stored_hash.startswith(b'$argon2'):
+        if _argon2_hasher is None:
+            logger.error("Stored argon2 hash found but argon2-cffi is not installed")
+            return False
+        try:
+            return _argon2_hasher.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    password_bytes = password.encode('utf-8')
+    if len(password_bytes) > BCRYPT_MAX_PASSWORD_BYTES: # 注册时已拒绝，不可能匹配
+        return False
+    # bcrypt.checkpw 内部使用常量时间比较
+    return bcrypt.checkpw(password_bytes, stored_hash)
+
+# 哈希计算是 CPU 密集型操作，放到进程池中执行，使并发登录可以利用多核且不阻塞 Flask 工作线程
+# 默认按 gunicorn worker 数 (WEB_CONCURRENCY) 平分 CPU，避免每个 worker 各开 cpu_count 个进程
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS') or max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1))))
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
+# 函数：创建哈希进程池 (gunicorn 下在 post_fork 中调用，此时 worker 只有主线程)
+# 传入 broken_pool 时表示该进程池已损坏，若尚未被其他线程重建则替换它
+def init_hash_pool(broken_pool=None):
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is not None and _hash_pool is not broken_pool:
+            return _hash_pool
+        if _hash_pool is not None:
+            _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+        _hash_pool.submit(int).result() # fork 启动方式下首次提交会一次性启动全部子进程
+        logger.info("Hash process pool started with %s workers", HASH_WORKERS)
+        return _hash_pool
+
+# 函数：在进程池中执行哈希函数；子进程异常退出导致进程池不可用时重建并重试一次
+def run_in_hash_pool(fn, *args):
+    pool = _hash_pool or init_hash_pool()
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        logger.error("Hash process pool is broken, recreating it")
+        return init_hash_pool(broken_pool=pool).submit(fn, *args).result()
 
 # 更新表的SQL语句，添加用户资料字段
 CREATE_TABLE_SQL = '''
 CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE NOT NULL,
-    hashed_password TEXT NOT NULL,
+    hashed_password BLOB NOT NULL,
     height REAL,          -- 使用 REAL (兼容 FLOAT)
     weight REAL,          -- 使用 REAL (兼容 FLOAT)
     age INTEGER,
@@ -27,49 +125,169 @@ CREATE TABLE IF NOT EXISTS users (
 );
 '''
 
-# 函数：获取数据库连接
+# --- 用户缓存 (username -> (hashed_password, profile)) ---
+# 缓存在进程内，失效只作用于当前进程；多个 gunicorn worker 时其他进程最多在 TTL 内返回旧资料
+USER_CACHE_MAX = 1024
+USER_CACHE_TTL = 60 # 秒
+_user_cache = OrderedDict() # username -> (expires_at, hashed_password, profile_dict)
+_user_cache_lock = threading.Lock()
+# username -> 失效次数；查询前记录，写缓存时若已变化说明期间数据被修改，不再写入旧行
+_user_generations = {}
+
+# 函数：获取用户当前的缓存代数 (需在查询数据库之前调用)
+def get_user_generation(username):
+    with _user_cache_lock:
+        return _user_generations.get(username, 0)
+
+# 函数：从缓存读取用户，未命中或过期返回 None
+def get_cached_user(username):
+    with _user_cache_lock:
+        entry = _user_cache.get(username)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _user_cache[username]
+            return None
+        _user_cache.move_to_end(username)
+        return entry[1], entry[2]
+
+# 函数：写入用户缓存 (LRU 淘汰)；generation 与当前不一致时放弃写入
+def cache_user(username, generation, hashed_password, profile):
+    with _user_cache_lock:
+        if _user_generations.get(username, 0) != generation:
+            return
+        _user_cache[username] = (time.monotonic() + USER_CACHE_TTL, hashed_password, profile)
+        _user_cache.move_to_end(username)
+        while len(_user_cache) > USER_CACHE_MAX:
+            _user_cache.popitem(last=False)
+
+# 函数：用户数据变更后使缓存失效
+def invalidate_user(username):
+    with _user_cache_lock:
+        _user_generations[username] = _user_generations.get(username, 0) + 1
+        _user_cache.pop(username, None)
+
+# 每个连接创建时执行的 PRAGMA (WAL 允许读写并发，64MB 缓存可让 users 表常驻内存)
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',    # 64 MB
+    'PRAGMA mmap_size=268435456',  # 256 MB
+)
+
+# --- 密码校验缓存 (只缓存成功的校验，客户端短时间内重复登录时跳过 bcrypt) ---
+VERIFY_CACHE_MAX = 4096
+VERIFY_CACHE_TTL = 30 # 秒
+_verify_cache = OrderedDict() # (username, stored_hash, sha256(password)) -> verified_until
+_verify_cache_lock = threading.Lock()
+
+# 函数：校验用户密码，命中缓存时不再计算 bcrypt
+def verify_password(username, password, stored_hash):
+    key = (username, stored_hash, hashlib.sha256(password.encode('utf-8')).digest())
+    now = time.monotonic()
+    with _verify_cache_lock:
+        verified_until = _verify_cache.get(key)
+        if verified_until is not None:
+            if verified_until > now:
+                _verify_cache.move_to_end(key)
+                return True
+            del _verify_cache[key]
+
+    if not run_in_hash_pool(check_password, password, stored_hash):
+        return False
+
+    with _verify_cache_lock:
+        _verify_cache[key] = time.monotonic() + VERIFY_CACHE_TTL
+        _verify_cache.move_to_end(key)
+        while len(_verify_cache) > VERIFY_CACHE_MAX:
+            _verify_cache.popitem(last=False)
+    return True
+
+# --- 数据库连接池 ---
+DB_POOL_SIZE = 8
+DB_CACHED_STATEMENTS = 256 # sqlite3 预编译语句缓存大小 (默认 128)
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+# 函数：创建新的长连接，并设置连接级 PRAGMA
+def _create_connection():
+    logger.debug("Creating new database connection")
+    db = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+    for pragma in SQLITE_PRAGMAS:
+        db.execute(pragma)
+    return db
+
+# 用户资料字段 (查询直接返回元组，按此顺序组装响应)
+PROFILE_FIELDS = ('username', 'height', 'weight', 'age', 'gender')
+SELECT_AUTH_USER_SQL = 'SELECT hashed_password, {} FROM users WHERE username = ? LIMIT 1'.format(', '.join(PROFILE_FIELDS))
+SELECT_PROFILE_SQL = 'SELECT {} FROM users WHERE username = ? LIMIT 1'.format(', '.join(PROFILE_FIELDS))
+
+# 部分更新的 SQL 在导入时为每个非空字段组合 (共 15 种) 预先生成，请求时只需查表
+UPDATABLE_FIELDS = ('height', 'weight', 'age', 'gender')
+UPDATE_TEMPLATES = {
+    frozenset(fields): 'UPDATE users SET {} WHERE username = ?'.format(", ".join(f"{field} = ?" for field in fields))
+    for n in range(1, len(UPDATABLE_FIELDS) + 1)
+    for fields in combinations(UPDATABLE_FIELDS, n)
+}
+
+# 函数：获取数据库连接 (优先复用连接池中的连接)
 def get_db():
     try:
         db = getattr(g, '_database', None)
         if db is None:
-            logger.debug("Creating new database connection")
-            db = g._database = sqlite3.connect(DATABASE)
-            db.row_factory = sqlite3.Row # 以字典形式获取结果
+            try:
+                db = _db_pool.get_nowait()
+            except queue.Empty:
+                db = _create_connection()
+            g._database = db
         return db
     except Exception as e:
-        logger.error(f"Error getting database connection: {e}")
+        logger.error("Error getting database connection: %s", e)
         raise
 
-# 函数：在应用关闭时关闭数据库连接
+# 函数：请求结束时将连接归还连接池 (池满则关闭)
 @app.teardown_appcontext
 def close_db(error):
+    db = g.pop('_database', None)
+    if db is None:
+        return
     try:
-        db = getattr(g, '_database', None)
-        if db is not None:
-            logger.debug("Closing database connection")
-            db.close()
+        if db.in_transaction:
+            db.rollback() # 不把未提交的事务带给下一个请求
+        _db_pool.put_nowait(db)
+    except queue.Full:
+        logger.debug("Connection pool full, closing database connection")
+        db.close()
     except Exception as e:
-        logger.error(f"Error closing database: {e}")
+        logger.error("Error returning database connection to pool: %s", e)
+        db.close()
 
 # 函数：初始化数据库，创建用户表
 def init_db():
+    if BCRYPT_COST is not None:
+        app.config['BCRYPT_COST'] = BCRYPT_COST
+    else:
+        app.config['BCRYPT_COST'] = calibrate_bcrypt_cost()
+    logger.info("Using bcrypt cost: %s", app.config['BCRYPT_COST'])
+    # 用户不存在时用于校验的哈希，启动时只计算一次；与新用户使用相同的算法和 cost，使响应耗时一致
+    app.config['DUMMY_PASSWORD_HASH'] = hash_password('x', app.config['BCRYPT_COST'])
     try:
         logger.info("Initializing database...")
         with app.app_context():
-            db = get_db()
+            db = get_db() # 新连接会应用 SQLITE_PRAGMAS (journal_mode=WAL 持久化到数据库文件)
             logger.debug("Executing CREATE TABLE IF NOT EXISTS")
             db.execute(CREATE_TABLE_SQL)
             db.commit()
             logger.info("Database initialized successfully")
     except Exception as e:
-        logger.error(f"Error initializing database: {e}")
+        logger.error("Error initializing database: %s", e)
 
 # 在应用启动时初始化数据库
 try:
     with app.app_context():
         init_db()
 except Exception as e:
-    logger.error(f"Failed to initialize DB during app setup: {e}")
+    logger.error("Failed to initialize DB during app setup: %s", e)
 
 # --- API 路由 (登录) ---
 @app.route('/simple_authenticate', methods=['POST'])
@@ -79,47 +297,46 @@ def simple_authenticate():
         auth_data = request.get_json()
         if not auth_data or 'username' not in auth_data or 'password' not in auth_data:
             logger.warning("Missing username or password in request")
-            return jsonify({"status": "failed", "message": "Missing username or password"}), 400
+            return _json({"status": "failed", "message": "Missing username or password"}, 400)
 
         username = auth_data.get('username')
         password = auth_data.get('password')
-        logger.debug(f"Authenticating user: {username}")
+        logger.debug("Authenticating user: %s", username)
 
-        db = get_db()
-        user = db.execute(
-            'SELECT id, username, hashed_password, height, weight, age, gender FROM users WHERE username = ?',
-            (username,)
-        ).fetchone()
-
-        if user:
-            stored_hashed_password = user['hashed_password']
-            if bcrypt.checkpw(password.encode('utf-8'), stored_hashed_password.encode('utf-8')):
-                logger.info(f"Authentication successful for user: {username}")
-                user_profile = {
-                    "username": user['username'],
-                    "height": user['height'],
-                    "weight": user['weight'],
-                    "age": user['age'],
-                    "gender": user['gender']
-                }
-                return jsonify({
+        cached = get_cached_user(username)
+        if cached is None:
+            generation = get_user_generation(username)
+            db = get_db()
+            user = db.execute(SELECT_AUTH_USER_SQL, (username,)).fetchone()
+            if user:
+                cached = (user[0], dict(zip(PROFILE_FIELDS, user[1:])))
+                cache_user(username, generation, *cached)
+        else:
+            logger.debug("User cache hit: %s", username)
+
+        if cached:
+            stored_hashed_password, user_profile = cached
+            if verify_password(username, password, stored_hashed_password):
+                logger.info("Authentication successful for user: %s", username)
+                return _json({
                     "status": "success",
                     "message": "Authentication successful",
-                    "user_id": username, # Keep user_id for consistency with previous versions if needed
                     "user_profile": user_profile
-                }), 200
+                }, 200)
             else:
-                logger.warning(f"Authentication failed for user: {username} (wrong password)")
-                return jsonify({"status": "failed", "message": "Invalid username or password"}), 401
+                logger.warning("Authentication failed for user: %s (wrong password)", username)
+                return _json({"status": "failed", "message": "Invalid username or password"}, 401)
         else:
-            logger.warning(f"Authentication failed: user {username} not found")
-            return jsonify({"status": "failed", "message": "Invalid username or password"}), 401
+            # 仍执行一次 bcrypt 校验，防止通过响应时间枚举用户名
+            run_in_hash_pool(check_password, password, app.config['DUMMY_PASSWORD_HASH'])
+            logger.warning("Authentication failed: user %s not found", username)
+            return _json({"status": "failed", "message": "Invalid username or password"}, 401)
     except sqlite3.Error as db_err:
-        logger.error(f"Database error during authentication for {username}: {db_err}")
-        return jsonify({"status": "error", "message": "Authentication failed due to database error"}), 500
+        logger.error("Database error during authentication for %s: %s", username, db_err)
+        return _json({"status": "error", "message": "Authentication failed due to database error"}, 500)
     except Exception as e:
-        logger.error(f"Unexpected error during authentication: {e}")
-        return jsonify({"status": "error", "message": "Authentication failed due to server error"}), 500
+        logger.error("Unexpected error during authentication: %s", e)
+        return _json({"status": "error", "message": "Authentication failed due to server error"}, 500)
 
 # --- API 路由 (注册) ---
 @app.route('/register', methods=['POST'])
@@ -129,7 +346,7 @@ def register():
         reg_data = request.get_json()
         if not reg_data or 'username' not in reg_data or 'password' not in reg_data:
             logger.warning("Missing username or password in registration request")
-            return jsonify({"status": "failed", "message": "Missing username or password"}), 400
+            return _json({"status": "failed", "message": "Missing username or password"}, 400)
 
         username = reg_data.get('username')
         password = reg_data.get('password')
@@ -137,20 +354,13 @@ def register():
         weight = reg_data.get('weight')
         age = reg_data.get('age')
         gender = reg_data.get('gender')
-        logger.debug(f"Registering new user: {username}")
+        logger.debug("Registering new user: %s", username)
 
         db = get_db()
-        existing_user = db.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
-        if existing_user:
-            logger.warning(f"Registration failed: username {username} already taken")
-            return jsonify({"status": "failed", "message": "Username already exists"}), 409
-
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
 
         # Basic validation before insert (optional but recommended)
         validated_data = {
             'username': username,
-            'hashed_password': hashed_password.decode('utf-8'),
             'height': None, 'weight': None, 'age': None, 'gender': None
         }
         try:
@@ -159,82 +369,83 @@ def register():
             if age is not None: validated_data['age'] = int(age)
             if gender is not None: validated_data['gender'] = str(gender)
         except ValueError as ve:
-             logger.warning(f"Invalid data type during registration for {username}: {ve}")
-             return jsonify({"status": "failed", "message": f"Invalid data type provided: {ve}"}), 400
-
-        db.execute(
-            'INSERT INTO users (username, hashed_password, height, weight, age, gender) VALUES (?, ?, ?, ?, ?, ?)',
-            (validated_data['username'], validated_data['hashed_password'], validated_data['height'],
-             validated_data['weight'], validated_data['age'], validated_data['gender'])
-        )
-        db.commit()
-        logger.info(f"User {username} registered successfully")
-        return jsonify({"status": "success", "message": "Registration successful"}), 201 # Use 201 Created
-
-    except sqlite3.IntegrityError:
-         db.rollback()
-         logger.warning(f"Registration failed: username {username} already taken (IntegrityError)")
-         return jsonify({"status": "failed", "message": "Username already exists"}), 409
+             logger.warning("Invalid data type during registration for %s: %s", username, ve)
+             return _json({"status": "failed", "message": f"Invalid data type provided: {ve}"}, 400)
+
+        if PASSWORD_HASHER == 'bcrypt' and len(password.encode('utf-8')) > BCRYPT_MAX_PASSWORD_BYTES:
+            logger.warning("Registration failed for %s: password longer than %s bytes", username, BCRYPT_MAX_PASSWORD_BYTES)
+            return _json({"status": "failed", "message": f"Password must be at most {BCRYPT_MAX_PASSWORD_BYTES} bytes"}, 400)
+
+        # 哈希前先做一次廉价的索引查询，已存在的用户名直接返回 409，不消耗 bcrypt 计算
+        if db.execute('SELECT 1 FROM users WHERE username = ? LIMIT 1', (username,)).fetchone():
+            logger.warning("Registration failed: username %s already taken", username)
+            return _json({"status": "failed", "message": "Username already exists"}, 409)
+
+        hashed_password = run_in_hash_pool(hash_password, password, app.config['BCRYPT_COST'])
+
+        # INSERT OR IGNORE 兜底并发注册同名用户的竞态，冲突时 rowcount 为 0
+        with db:
+            cur = db.execute(
+                'INSERT OR IGNORE INTO users (username, hashed_password, height, weight, age, gender) VALUES (?, ?, ?, ?, ?, ?)',
+                (validated_data['username'], hashed_password, validated_data['height'],
+                 validated_data['weight'], validated_data['age'], validated_data['gender'])
+            )
+        if cur.rowcount == 0:
+            logger.warning("Registration failed: username %s already taken", username)
+            return _json({"status": "failed", "message": "Username already exists"}, 409)
+        invalidate_user(username)
+        logger.info("User %s registered successfully", username)
+        return _json({"status": "success", "message": "Registration successful"}, 201) # Use 201 Created
+
     except sqlite3.Error as db_err:
         db.rollback()
-        logger.error(f"Database error during registration for {username}: {db_err}")
-        return jsonify({"status": "error", "message": "Registration failed due to database error"}), 500
+        logger.error("Database error during registration for %s: %s", username, db_err)
+        return _json({"status": "error", "message": "Registration failed due to database error"}, 500)
     except Exception as e:
         db.rollback()
-        logger.error(f"Unexpected error during registration: {e}")
-        return jsonify({"status": "error", "message": "Registration failed due to server error"}), 500
+        logger.error("Unexpected error during registration: %s", e)
+        return _json({"status": "error", "message": "Registration failed due to server error"}, 500)
 
 # --- API路由 (获取用户资料) ---
 @app.route('/user_profile/<username>', methods=['GET'])
 def get_user_profile(username):
     # SECURITY NOTE: In a real app, verify the requesting user is allowed to see this profile!
     try:
-        logger.debug(f"Getting profile for user: {username}")
+        logger.debug("Getting profile for user: %s", username)
         db = get_db()
-        user = db.execute(
-            'SELECT username, height, weight, age, gender FROM users WHERE username = ?',
-            (username,)
-        ).fetchone()
+        user = db.execute(SELECT_PROFILE_SQL, (username,)).fetchone()
 
         if not user:
-            logger.warning(f"User profile not found: {username}")
-            return jsonify({"status": "failed", "message": "User not found"}), 404
+            logger.warning("User profile not found: %s", username)
+            return _json({"status": "failed", "message": "User not found"}, 404)
 
-        user_dict = dict(user) # Convert SQLite Row to dict
-        logger.info(f"User profile retrieved for: {username}")
-        return jsonify({"status": "success", "user_profile": user_dict}), 200
+        user_dict = dict(zip(PROFILE_FIELDS, user)) # 行为普通元组，按列顺序组装
+        logger.info("User profile retrieved for: %s", username)
+        return _json({"status": "success", "user_profile": user_dict}, 200)
 
     except sqlite3.Error as db_err:
-         logger.error(f"Database error retrieving profile for {username}: {db_err}")
-         return jsonify({"status": "error", "message": "Failed to retrieve user profile due to database error"}), 500
+         logger.error("Database error retrieving profile for %s: %s", username, db_err)
+         return _json({"status": "error", "message": "Failed to retrieve user profile due to database error"}, 500)
     except Exception as e:
-        logger.error(f"Error retrieving user profile for {username}: {e}")
-        return jsonify({"status": "error", "message": "Failed to retrieve user profile due to server error"}), 500
+        logger.error("Error retrieving user profile for %s: %s", username, e)
+        return _json({"status": "error", "message": "Failed to retrieve user profile due to server error"}, 500)
 
 # --- API路由 (更新用户资料 - 支持部分更新) ---
 @app.route('/user_profile/<username>', methods=['PUT'])
 def update_user_profile(username):
     # SECURITY NOTE: In a real app, verify the requesting user IS <username> or has permission!
     try:
-        logger.debug(f"Attempting partial profile update for user: {username}")
+        logger.debug("Attempting partial profile update for user: %s", username)
         profile_data = request.get_json()
 
         if not profile_data:
-            logger.warning(f"Missing profile data in PUT request for {username}")
-            return jsonify({"status": "failed", "message": "Missing profile data"}), 400
+            logger.warning("Missing profile data in PUT request for %s", username)
+            return _json({"status": "failed", "message": "Missing profile data"}, 400)
 
         db = get_db()
-        # 检查用户是否存在
-        existing_user = db.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
-        if not existing_user:
-            logger.warning(f"Update failed: user {username} not found")
-            return jsonify({"status": "failed", "message": "User not found"}), 404
-
         # --- Start: Partial Update Logic ---
         fields_to_update = {}
-        valid_fields = ['height', 'weight', 'age', 'gender']
-
-        for field in valid_fields:
+        for field in UPDATABLE_FIELDS:
             if field in profile_data: # Check if key exists in request JSON
                 value = profile_data[field]
                 # Basic data type validation for fields being updated
@@ -250,47 +461,50 @@ def update_user_profile(username):
                     elif value is None: # Allow explicit null setting for other fields
                          fields_to_update[field] = None
                 except ValueError:
-                    logger.warning(f"Invalid data type for field '{field}' for user {username}")
-                    return jsonify({"status": "failed", "message": f"Invalid data type for field '{field}'"}), 400
+                    logger.warning("Invalid data type for field '%s' for user %s", field, username)
+                    return _json({"status": "failed", "message": f"Invalid data type for field '{field}'"}, 400)
 
         if not fields_to_update:
-            logger.info(f"No valid fields provided to update for user: {username}")
+            logger.info("No valid fields provided to update for user: %s", username)
             # Decide what to return: success with message, or maybe 400? Let's return success.
-            return jsonify({"status": "success", "message": "No fields provided or updated"}), 200
+            return _json({"status": "success", "message": "No fields provided or updated"}, 200)
 
-        # Dynamically build the SET clause and values list
-        set_clause = ", ".join([f"{key} = ?" for key in fields_to_update.keys()])
-        values = list(fields_to_update.values())
-        values.append(username) # Add username for the WHERE clause
+        # fields_to_update 按 UPDATABLE_FIELDS 顺序填充，与模板中占位符的顺序一致
+        sql = UPDATE_TEMPLATES[frozenset(fields_to_update)]
+        values = (*fields_to_update.values(), username) # username 用于 WHERE 子句
 
-        sql = f'UPDATE users SET {set_clause} WHERE username = ?'
-        logger.debug(f"Executing SQL: {sql} with values: {values}")
+        logger.debug("Executing SQL: %s with values: %s", sql, values)
         # --- End: Partial Update Logic ---
 
-        db.execute(sql, values)
-        db.commit()
+        # 用户是否存在由 UPDATE 影响的行数判断，省去一次 SELECT
+        with db:
+            cur = db.execute(sql, values)
+        if cur.rowcount == 0:
+            logger.warning("Update failed: user %s not found", username)
+            return _json({"status": "failed", "message": "User not found"}, 404)
+        invalidate_user(username)
 
-        logger.info(f"User profile partially updated for: {username}")
-        return jsonify({"status": "success", "message": "Profile updated successfully"}), 200
+        logger.info("User profile partially updated for: %s", username)
+        return _json({"status": "success", "message": "Profile updated successfully"}, 200)
 
     except sqlite3.Error as db_err:
         db.rollback()
-        logger.error(f"Database error during profile update for {username}: {db_err}")
-        return jsonify({"status": "error", "message": "Profile update failed due to database error"}), 500
+        logger.error("Database error during profile update for %s: %s", username, db_err)
+        return _json({"status": "error", "message": "Profile update failed due to database error"}, 500)
     except Exception as e:
         db.rollback() # Ensure rollback on any exception during the process
-        logger.error(f"Error updating user profile for {username}: {e}")
-        return jsonify({"status": "error", "message": "Profile update failed due to server error"}), 500
+        logger.error("Error updating user profile for %s: %s", username, e)
+        return _json({"status": "error", "message": "Profile update failed due to server error"}, 500)
 
 
 # 添加健康检查端点
 @app.route('/', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok", "message": "Server is running"}), 200
+    return _json({"status": "ok", "message": "Server is running"}, 200)
 
 
 # --- 应用启动 ---
 if __name__ == '__main__':
-    # Development server
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
-# else: Production environment handled by WSGI server
\ No newline at end of file
+    # Development server (仅用于本地调试，设置 FLASK_DEBUG=1 开启 debug)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+# else: Production environment handled by WSGI server: gunicorn app:app (见 gunicorn.conf.py)
\ No newline at end of file
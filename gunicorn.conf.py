@@ -0,0 +1,17 @@
+# Gunicorn 配置 (gunicorn app:app 启动时自动加载)
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+# 默认单进程 + 多线程：密码哈希已在独立的进程池中并行计算，请求线程只做 I/O。
+# 用户缓存在进程内，失效只作用于当前 worker (同一 worker 内的线程由缓存代数保证不回填旧数据)；
+# 若调大 WEB_CONCURRENCY，其他 worker 可能在 USER_CACHE_TTL 内返回旧的 user_profile。
+# 每个 worker 启动时各自校准 bcrypt cost (不低于 12)；多 worker 部署时建议设置 BCRYPT_COST 使各 worker 一致。
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def post_fork(server, worker):
+    # 在 worker 开始处理请求 (启动线程) 之前创建哈希进程池
+    from app import init_hash_pool
+    init_hash_pool()
@@ -2,5 +2,5 @@ DROP TABLE IF EXISTS users;
 CREATE TABLE users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE NOT NULL,
-    hashed_password TEXT NOT NULL
+    hashed_password BLOB NOT NULL
 );
\ No newline at end of file